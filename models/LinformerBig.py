@@ -235,7 +235,7 @@ class ClusteredLinformerAttention(layers.Layer):
             )
             v_proj = tf.einsum("bhcld,hcl->bhcd", v_chunks, self.cluster_F_W)
 
-        dk = tf.cast(self.depth, tf.float32)
+        dk = tf.cast(self.depth, q.dtype)
         scores = tf.matmul(q, k_proj, transpose_b=True) / tf.math.sqrt(dk)
         if self.convolution:
             scores = self.attn_conv(scores)
@@ -332,5 +332,6 @@ def build_linformer_transformer_classifier_big(
         activation = "sigmoid"
     else:
         activation = "softmax"
-    outputs = layers.Dense(output_dim, activation=activation)(x)
+    # keep the classifier head in float32 for a numerically stable softmax/sigmoid
+    outputs = layers.Dense(output_dim, activation=activation, dtype="float32")(x)
     return Model(inputs, outputs)
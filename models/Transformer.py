@@ -116,7 +116,7 @@ class StandardMultiHeadAttention(layers.Layer):
         k = self.split_heads(k, batch_size)
         v = self.split_heads(v, batch_size)
 
-        dk = tf.cast(self.depth, tf.float32)
+        dk = tf.cast(self.depth, q.dtype)
         scores = tf.matmul(q, k, transpose_b=True) / tf.math.sqrt(dk)
 
         if self.convolution:
@@ -173,5 +173,6 @@ def build_standard_transformer_classifier(
         activation = 'sigmoid'
     else:
         activation = 'softmax'
-    outputs = layers.Dense(output_dim, activation=activation)(x)
+    # keep the classifier head in float32 for a numerically stable softmax/sigmoid
+    outputs = layers.Dense(output_dim, activation=activation, dtype="float32")(x)
     return Model(inputs, outputs)
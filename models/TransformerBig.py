@@ -151,7 +151,7 @@ class StandardMultiHeadAttention(layers.Layer):
         k = self.split_heads(k, batch_size)
         v = self.split_heads(v, batch_size)
 
-        dk = tf.cast(self.depth, tf.float32)
+        dk = tf.cast(self.depth, q.dtype)
         scores = tf.matmul(q, k, transpose_b=True) / tf.math.sqrt(dk)
 
         if self.convolution:
@@ -232,5 +232,6 @@ def build_standard_transformer_classifier_big(
         activation = "sigmoid"
     else:
         activation = "softmax"
-    outputs = layers.Dense(output_dim, activation=activation)(x)
+    # keep the classifier head in float32 for a numerically stable softmax/sigmoid
+    outputs = layers.Dense(output_dim, activation=activation, dtype="float32")(x)
     return Model(inputs, outputs)
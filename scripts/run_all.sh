@@ -15,6 +15,7 @@ Usage: $0 \
   [--proj_dim N] \
   [--num_particles N1,N2,...] \
   [--sort_by pt,eta,phi,delta_R,kt,cluster] \
+  [--report_flops] [--no_mixed_precision] \
   [--cluster_E] [--cluster_F] [--share_EF] [--convolution] \
   [--num_layers N]
 EOF
@@ -34,6 +35,8 @@ HEADS_FLAG=""
 PROJ_DIM_FLAG=""
 NP_LIST=""
 SORT_MODES=""
+FLOPS_FLAG=""
+PRECISION_FLAG=""
 
 # Parse args
 while [[ $# -gt 0 ]]; do
@@ -60,6 +63,10 @@ while [[ $# -gt 0 ]]; do
       NP_LIST="$2"; shift 2;;
     --sort_by)
       SORT_MODES="$2"; shift 2;;
+    --report_flops)
+      FLOPS_FLAG="--report_flops"; shift;;
+    --no_mixed_precision)
+      PRECISION_FLAG="--no_mixed_precision"; shift;;
     --cluster_E)
       CLUSTER_E_FLAG="--cluster_E"; shift;;
     --cluster_F)
@@ -104,6 +111,8 @@ for NP in "${PARTICLES[@]}"; do
       $PROJ_DIM_FLAG \
       --num_particles "$NP" \
       --sort_by       "$SORT" \
+      $FLOPS_FLAG \
+      $PRECISION_FLAG \
       $CLUSTER_E_FLAG \
       $CLUSTER_F_FLAG \
       $SHARE_EF_FLAG \
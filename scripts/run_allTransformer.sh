@@ -16,7 +16,8 @@ usage() {
     --num_heads N \
     --num_particles N \
     --sort_by pt|eta|phi|delta_R|kt|cluster\
-    --num_layers N
+    --num_layers N \
+    [--no_mixed_precision] [--report_flops]
 EOF
   exit 1
 }
@@ -28,6 +29,8 @@ SHARE_EF_FLAG=""
 CONVOLUTION_FLAG=""
 CONV_FILTER_HEIGHTS_FLAG=""
 VERTICAL_STRIDE_FLAG=""
+PRECISION_FLAG=""
+FLOPS_FLAG=""
 
 # Parse args
 while [[ $# -gt 0 ]]; do
@@ -46,6 +49,8 @@ while [[ $# -gt 0 ]]; do
     --num_particles) NP_LIST="$2"; shift 2;;
     --sort_by) SORT_MODES="$2"; shift 2;;
     --num_layers) NUM_LAYERS="$2"; shift 2;;
+    --no_mixed_precision) PRECISION_FLAG="--no_mixed_precision"; shift;;
+    --report_flops) FLOPS_FLAG="--report_flops"; shift;;
     *) echo "Unknown argument: $1"; usage;;
   esac
 done
@@ -76,6 +81,8 @@ for NP in "${PARTICLES[@]}"; do
       ${CONVOLUTION_FLAG} \
       ${CONV_FILTER_HEIGHTS_FLAG} \
       ${VERTICAL_STRIDE_FLAG} \
+      ${PRECISION_FLAG} \
+      ${FLOPS_FLAG} \
       --batch_size           "${BATCH_SIZE}" \
       --num_epochs           "${NUM_EPOCHS}" \
       --d_model              "${D_MODEL}" \
@@ -9,7 +9,6 @@ if PROJECT_ROOT not in sys.path:
     sys.path.insert(0, PROJECT_ROOT)
 # ─────────────────────────────────────────────────────────────────────────────
 
-import time
 import argparse
 import logging
 import glob
@@ -17,7 +16,6 @@ import glob
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.models import load_model
-import fastjet as fj
 from sklearn.metrics import accuracy_score, roc_curve, auc, roc_auc_score
 import matplotlib.pyplot as plt
 
@@ -30,6 +28,7 @@ from models.Linformer import (
     LinformerTransformerBlock,
 )
 from models.Transformer import StandardTransformerBlock
+from train_utils import load_sorted_features, one_vs_rest_roc_curves, time_inference
 
 
 def profile_gpu_memory_during_inference(
@@ -76,49 +75,49 @@ def get_flops(model, input_shape):
         return flops.total_float_ops
 
 
-def sort_events_by_cluster(x, R, batch_size):
+def sort_events_by_cluster(x, R, batch_size, out=None):
+    # fastjet (and awkward) are slow to import and only needed for cluster sorting
+    import awkward as ak
+    import fastjet as fj
+
     n_events, n_particles, _ = x.shape
-    sorted_x = np.zeros_like(x)
+    # every event is fully overwritten, so `out` (e.g. a memmap) needs no zeroing
+    sorted_x = out if out is not None else np.empty(x.shape, dtype=x.dtype)
     jet_def = fj.JetDefinition(fj.antikt_algorithm, R)
     for i0 in range(0, n_events, batch_size):
         batch = x[i0 : i0 + batch_size]
-        for bi, ev in enumerate(batch):
-            pts, etas, phis = ev[:, 0], ev[:, 1], ev[:, 2]
-            px = pts * np.cos(phis)
-            py = pts * np.sin(phis)
-            pz = pts * np.sinh(etas)
-            E = pts * np.cosh(etas)
-            ps = [fj.PseudoJet(px[j], py[j], pz[j], E[j]) for j in range(len(pts))]
-            for j, pj in enumerate(ps):
-                pj.set_user_index(j)
-            seq = fj.ClusterSequence(ps, jet_def)
-            jets = seq.inclusive_jets()
-            jets.sort(key=lambda J: J.perp(), reverse=True)
-            idxs = [c.user_index() for J in jets for c in J.constituents()]
-            remain = [j for j in range(len(pts)) if j not in idxs]
-            idxs.extend(remain)
-            sorted_x[i0 + bi] = ev[idxs]
+        # four-momenta per batch rather than for the whole tensor, so peak
+        # memory stays per batch (and a memory-mapped x is read per batch)
+        pts, etas, phis = batch[:, :, 0], batch[:, :, 1], batch[:, :, 2]
+        px = pts * np.cos(phis)
+        py = pts * np.sin(phis)
+        pz = pts * np.sinh(etas)
+        E = pts * np.cosh(etas)
+        # cluster the whole batch in one call through the awkward-array interface
+        parts = ak.from_regular(ak.zip({"px": px, "py": py, "pz": pz, "E": E}), axis=1)
+        seq = fj.ClusterSequence(parts, jet_def)
+        # query the clustering once: jet pT is rebuilt from the constituent
+        # momenta already in hand instead of a second inclusive_jets() pass
+        jet_consts = seq.constituent_index(min_pt=0)
+        flat = ak.flatten(jet_consts, axis=2)
+        jet_sizes = ak.flatten(ak.num(jet_consts, axis=2))
+        jet_px = ak.sum(ak.unflatten(parts.px[flat], jet_sizes, axis=1), axis=2)
+        jet_py = ak.sum(ak.unflatten(parts.py[flat], jet_sizes, axis=1), axis=2)
+        jet_order = ak.argsort(jet_px**2 + jet_py**2, axis=1, ascending=False)
+        consts = ak.flatten(jet_consts[jet_order], axis=2)
+        idxs = ak.to_numpy(
+            ak.fill_none(ak.pad_none(consts, n_particles, clip=True), -1)
+        )
+        idxs = idxs.astype(np.int64)
+        # append particles left out of every jet, in their original order
+        clustered = idxs >= 0
+        leftover = np.ones(idxs.shape, dtype=bool)
+        leftover[np.nonzero(clustered)[0], idxs[clustered]] = False
+        idxs[~clustered] = np.nonzero(leftover)[1]
+        sorted_x[i0 : i0 + len(batch)] = batch[np.arange(len(batch))[:, None], idxs]
     return sorted_x
 
 
-def apply_sorting(x, sort_by, R, batch_size):
-    if sort_by in ("pt", "eta", "phi", "delta_R", "kt"):
-        if sort_by == "pt":
-            key = x[:, :, 0]
-        elif sort_by == "eta":
-            key = x[:, :, 1]
-        elif sort_by == "phi":
-            key = x[:, :, 2]
-        elif sort_by == "delta_R":
-            key = np.sqrt(x[:, :, 1] ** 2 + x[:, :, 2] ** 2)
-        else:
-            key = x[:, :, 0] * np.sqrt(x[:, :, 1] ** 2 + x[:, :, 2] ** 2)
-        idx = np.argsort(key, axis=1)[:, ::-1]
-        return np.take_along_axis(x, idx[:, :, None], axis=1)
-    else:
-        return sort_events_by_cluster(x, R, batch_size)
-
-
 def process_directory(
     data_dir, save_dir, sort_by, cluster_R=0.4, cluster_batch_size=1024, batch_size=4096
 ):
@@ -162,11 +161,16 @@ def process_directory(
     feat_dim = model.input_shape[2]
     x_file = f"x_val_robust_{num_particles}const_ptetaphi.npy"
     y_file = f"y_val_robust_{num_particles}const_ptetaphi.npy"
-    x = np.load(os.path.join(data_dir, x_file))
+    x = load_sorted_features(
+        os.path.join(data_dir, x_file),
+        sort_by,
+        cluster_sort=lambda x, out: sort_events_by_cluster(
+            x, cluster_R, cluster_batch_size, out=out
+        ),
+        cluster_R=cluster_R,
+    )
     y = np.load(os.path.join(data_dir, y_file))
     logging.info("Loaded TEST arrays: %s, %s", x_file, y_file)
-
-    x = apply_sorting(x, sort_by, cluster_R, cluster_batch_size)
     logging.info("Applied '%s' sorting to TEST set", sort_by)
 
     # FLOPs & timing
@@ -176,13 +180,7 @@ def process_directory(
     logging.info("MACs per inference: %d", macs)
 
     # inference timing
-    _ = model.predict(x[:batch_size], batch_size=batch_size)
-    times = []
-    for _ in range(20):
-        t0 = time.perf_counter()
-        _ = model.predict(x[:batch_size], batch_size=batch_size)
-        times.append(time.perf_counter() - t0)
-    avg_ns = np.mean(times) / batch_size * 1e9
+    avg_ns = time_inference(model, x[:batch_size])
     logging.info("Avg inference time / event: %.2f ns", avg_ns)
 
     # Profile GPU memory usage
@@ -203,8 +201,8 @@ def process_directory(
     class_labels = ["g", "q", "W", "Z", "t"]
     plt.figure(figsize=(6, 6))
     one_over_fpr = {}
-    for i, label in enumerate(class_labels):
-        fpr_vals, tpr_vals, _ = roc_curve(y[:, i], preds[:, i])
+    curves = one_vs_rest_roc_curves(y, preds)
+    for label, (fpr_vals, tpr_vals) in zip(class_labels, curves):
         roc_auc_val = auc(fpr_vals, tpr_vals)
         logging.info("ROC AUC for %s: %.4f", label, roc_auc_val)
         plt.plot(fpr_vals, tpr_vals, label=f"{label} (AUC={roc_auc_val:.2f})")
@@ -4,12 +4,12 @@ import random
 import sys
 import time
 import argparse
+import json
 import logging
 
 import numpy as np
 import tensorflow as tf
 from tensorflow.keras.callbacks import ReduceLROnPlateau, EarlyStopping, ModelCheckpoint
-import fastjet as fj
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, roc_curve, auc, roc_auc_score
 import matplotlib.pyplot as plt
@@ -23,6 +23,14 @@ if PROJECT_ROOT not in sys.path:
 
 from models.Transformer import AggregationLayer, build_standard_transformer_classifier
 from models.TransformerBig import build_standard_transformer_classifier_big
+from train_utils import (
+    get_flops_cached,
+    load_sorted_features,
+    make_dataset,
+    one_vs_rest_roc_curves,
+    set_mixed_precision_policy,
+    time_inference,
+)
 
 
 # ----------------------------------------------------------------------------
@@ -70,68 +78,55 @@ def profile_gpu_memory_during_inference(
     return current_mb, peak_mb
 
 
-# ---------------------------
-# Sorting helper
-# ---------------------------
-def apply_sorting(x, sort_by):
-    if sort_by == "pt":
-        key = x[:, :, 0]
-    elif sort_by == "eta":
-        key = x[:, :, 1]
-    elif sort_by == "phi":
-        key = x[:, :, 2]
-    elif sort_by == "delta_R":
-        key = np.sqrt(x[:, :, 1] ** 2 + x[:, :, 2] ** 2)
-    elif sort_by == "kt":
-        key = x[:, :, 0] * np.sqrt(x[:, :, 1] ** 2 + x[:, :, 2] ** 2)
-    else:
-        return x
-    idx = np.argsort(key, axis=1)[:, ::-1]
-    return np.take_along_axis(x, idx[:, :, None], axis=1)
-
-
 # ---------------------------
 # Testing / Profiling
 # ---------------------------
-def run_testing(model, dataset, data_dir, save_dir, sort_by, batch_size, num_particles):
+def run_testing(
+    model,
+    dataset,
+    data_dir,
+    save_dir,
+    sort_by,
+    batch_size,
+    num_particles,
+    flops_cache=None,
+    flops_key=None,
+):
     logging.info("Starting testing phase...")
 
     # load test set
     if dataset == "hls4ml":
-        x_test = np.load(
-            os.path.join(data_dir, f"x_val_robust_{num_particles}const_ptetaphi.npy")
+        x_test = load_sorted_features(
+            os.path.join(data_dir, f"x_val_robust_{num_particles}const_ptetaphi.npy"),
+            sort_by,
         )
         y_test = np.load(
             os.path.join(data_dir, f"y_val_robust_{num_particles}const_ptetaphi.npy")
         )
     else:  # jetclass, top, or QG
-        x_test = np.load(os.path.join(data_dir, "test/features.npy"))
+        x_test = load_sorted_features(
+            os.path.join(data_dir, "test/features.npy"),
+            sort_by,
+            transpose=dataset == "jetclass",
+        )
         y_test = np.load(os.path.join(data_dir, "test/labels.npy"))
-        if dataset == "jetclass":
-            x_test = x_test.transpose(0, 2, 1)
     logging.info(
         "Loaded TEST arrays for %s: %s, %s", dataset, x_test.shape, y_test.shape
     )
-
-    # sorting for test
-    x_test = apply_sorting(x_test, sort_by)
     logging.info("Applied '%s' sorting to TEST set", sort_by)
 
-    # flops & macs
-    num_p, feat_d = x_test.shape[1], x_test.shape[2]
-    flops = get_flops(model, (1, num_p, feat_d))
-    macs = flops // 2
-    logging.info("FLOPs per inference: %d", flops)
-    logging.info("MACs per inference: %d", macs)
+    # flops & macs (opt-in: freezing and profiling the graph is slow)
+    if flops_key is not None:
+        num_p, feat_d = x_test.shape[1], x_test.shape[2]
+        flops = get_flops_cached(
+            get_flops, model, (1, num_p, feat_d), flops_cache, flops_key
+        )
+        macs = flops // 2
+        logging.info("FLOPs per inference: %d", flops)
+        logging.info("MACs per inference: %d", macs)
 
     # timing
-    _ = model.predict(x_test[:batch_size], batch_size=batch_size)
-    times = []
-    for _ in range(20):
-        t0 = time.perf_counter()
-        _ = model.predict(x_test[:batch_size], batch_size=batch_size)
-        times.append(time.perf_counter() - t0)
-    avg_ns = np.mean(times) / batch_size * 1e9
+    avg_ns = time_inference(model, x_test[:batch_size])
     logging.info("Avg inference time/event: %.2f ns", avg_ns)
 
     # GPU memory
@@ -171,11 +166,11 @@ def run_testing(model, dataset, data_dir, save_dir, sort_by, batch_size, num_par
 
     plt.figure(figsize=(6, 6))
     one_over_fpr = {}
-    for i, lab in enumerate(labels):
-        if dataset == "top" or dataset == "QG":
-            fpr, tpr, _ = roc_curve(y_test, preds.ravel())
-        else:
-            fpr, tpr, _ = roc_curve(y_test[:, i], preds[:, i])
+    if dataset == "top" or dataset == "QG":
+        curves = [roc_curve(y_test, preds.ravel())[:2]] * len(labels)
+    else:
+        curves = one_vs_rest_roc_curves(y_test, preds)
+    for lab, (fpr, tpr) in zip(labels, curves):
         roc_val = auc(fpr, tpr)
         plt.plot(fpr, tpr, label=f"{lab} (AUC={roc_val:.2f})")
         if np.max(tpr) >= 0.8:
@@ -250,6 +245,16 @@ def parse_args():
     p.add_argument("--cluster_R", type=float, default=0.4)
     p.add_argument("--cluster_batch_size", type=int, default=1024)
     p.add_argument("--num_layers", type=int, default=1, help="Number of layers")
+    p.add_argument(
+        "--report_flops",
+        action="store_true",
+        help="Report FLOPs/MACs per inference (cached in save_dir/flops_cache.json)",
+    )
+    p.add_argument(
+        "--no_mixed_precision",
+        action="store_true",
+        help="Train in float32 even when the GPU supports mixed precision",
+    )
     return p.parse_args()
 
 
@@ -295,12 +300,16 @@ def main():
     )
     logging.info("Args: %s", args)
 
+    if not args.no_mixed_precision:
+        logging.info("Precision policy: %s", set_mixed_precision_policy())
+
     # load train/val
     if args.dataset == "hls4ml":
-        x = np.load(
+        x = load_sorted_features(
             os.path.join(
                 args.data_dir, f"x_train_robust_{num_particles}const_ptetaphi.npy"
-            )
+            ),
+            args.sort_by,
         )
         y = np.load(
             os.path.join(
@@ -311,15 +320,16 @@ def main():
             x, y, test_size=args.val_split, random_state=42
         )
     else:  # jetclass, top, or QG
-        x_train = np.load(os.path.join(args.data_dir, "train/features.npy"))
+        transpose = args.dataset == "jetclass"
+        x_train = load_sorted_features(
+            os.path.join(args.data_dir, "train/features.npy"), args.sort_by, transpose
+        )
         y_train = np.load(os.path.join(args.data_dir, "train/labels.npy"))
-        x_val = np.load(os.path.join(args.data_dir, "val/features.npy"))
+        x_val = load_sorted_features(
+            os.path.join(args.data_dir, "val/features.npy"), args.sort_by, transpose
+        )
         y_val = np.load(os.path.join(args.data_dir, "val/labels.npy"))
 
-    if args.dataset == "jetclass":
-        x_train = x_train.transpose(0, 2, 1)
-        x_val = x_val.transpose(0, 2, 1)
-
     logging.info(
         "Loaded train x=%s y=%s, val x=%s y=%s",
         x_train.shape,
@@ -328,10 +338,6 @@ def main():
         y_val.shape,
     )
 
-    # apply sorting
-    x_train = apply_sorting(x_train, args.sort_by)
-    x_val = apply_sorting(x_val, args.sort_by)
-
     # Build standard transformer classifier
     if args.num_layers > 1:
         model = build_standard_transformer_classifier_big(
@@ -358,6 +364,8 @@ def main():
         optimizer=tf.keras.optimizers.Adam(),
         loss=loss_fn,
         metrics=["accuracy"],
+        # fuse the small attention/FFN matmuls of each train step with XLA
+        jit_compile=True,
     )
     model.summary(print_fn=lambda l: logging.info(l))
     logging.info("Total params: %d", model.count_params())
@@ -395,13 +403,13 @@ def main():
     histories = []
     for bs, ep in schedule:
         tf.keras.backend.set_value(model.optimizer.lr, 1e-3)
+        train_ds = make_dataset(x_train, y_train, bs, shuffle=True)
+        val_ds = make_dataset(x_val, y_val, bs)
         hist = model.fit(
-            x_train,
-            y_train,
-            validation_data=(x_val, y_val),
+            train_ds,
+            validation_data=val_ds,
             initial_epoch=ce,
             epochs=ce + ep,
-            batch_size=bs,
             callbacks=[ckpt, early],
             verbose=1,
         )
@@ -440,6 +448,23 @@ def main():
     plt.savefig(os.path.join(save_dir, "accuracy_curve.png"))
     plt.close()
 
+    # FLOPs only depend on the traced graph, i.e. on these settings
+    flops_key = None
+    if args.report_flops:
+        flops_key = json.dumps(
+            dict(
+                num_particles=num_particles,
+                feature_dim=x_train.shape[2],
+                output_dim=args.output_dim,
+                d_model=args.d_model,
+                d_ff=args.d_ff,
+                num_heads=args.num_heads,
+                num_layers=args.num_layers,
+                convolution=args.convolution,
+            ),
+            sort_keys=True,
+        )
+
     # final testing
     run_testing(
         model,
@@ -449,6 +474,8 @@ def main():
         args.sort_by,
         args.batch_size,
         args.num_particles,
+        flops_cache=os.path.join(args.save_dir, "flops_cache.json"),
+        flops_key=flops_key,
     )
 
 
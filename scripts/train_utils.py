@@ -0,0 +1,213 @@
+"""
+Helpers shared by the training scripts and test.py.
+"""
+import os
+import json
+import time
+import hashlib
+import logging
+
+import numpy as np
+import tensorflow as tf
+
+# part of every sorted-array cache key; bump it whenever SORT_KEYS or the
+# cluster ordering changes so arrays cached by older code are not reused
+SORT_VERSION = 1
+
+# sort key for each mode; particles are ordered by descending key
+SORT_KEYS = {
+    "pt": lambda x: x[:, :, 0],
+    "eta": lambda x: x[:, :, 1],
+    "phi": lambda x: x[:, :, 2],
+    # sqrt is monotonic, so the squared distance gives the same order
+    "delta_R": lambda x: x[:, :, 1] ** 2 + x[:, :, 2] ** 2,
+    # pt * |pt| * dR^2 orders like pt * dR, also for negative (scaled) pt
+    "kt": lambda x: (
+        x[:, :, 0] * np.abs(x[:, :, 0]) * (x[:, :, 1] ** 2 + x[:, :, 2] ** 2)
+    ),
+}
+
+
+def _sort_desc(key, x):
+    """Reorder the particles of every event in x by descending key."""
+    if np.issubdtype(key.dtype, np.floating):
+        idx = np.argsort(-key, axis=1)
+    else:
+        # negating an integer key can overflow; reverse a stable sort instead
+        idx = np.ascontiguousarray(np.argsort(key, axis=1, kind="stable")[:, ::-1])
+    # gather whole particle rows instead of broadcasting idx over the features
+    return x[np.arange(x.shape[0])[:, None], idx]
+
+
+def load_sorted_features(
+    x_path, sort_by, transpose=False, cluster_sort=None, cluster_R=None
+):
+    """
+    Load the features at x_path (transposed to (events, particles, features)
+    if requested) with `sort_by` ordering applied. The sorted array is cached
+    next to x_path and memory-mapped by later runs of any script that sorts
+    the same file the same way.
+
+    Cluster sorting is done by `cluster_sort(x, out)`, which fills `out`
+    (a memmap of the cache file) when it is not None; `cluster_R` is part of
+    its cache key. Without a cluster_sort the features are returned unsorted
+    and nothing is cached.
+    """
+    if sort_by not in SORT_KEYS and not (sort_by == "cluster" and cluster_sort):
+        # no sort to apply, so caching would just copy the input
+        x = np.load(x_path, mmap_mode="r")
+        return x.transpose(0, 2, 1) if transpose else x
+
+    st = os.stat(x_path)
+    tag = f"{SORT_VERSION}|{os.path.abspath(x_path)}|{st.st_mtime_ns}"
+    tag += f"|{sort_by}|{transpose}"
+    if sort_by == "cluster":
+        tag += f"|{cluster_R}"
+    key = hashlib.sha1(tag.encode()).hexdigest()[:12]
+    cache_dir = os.path.dirname(x_path)
+    cache = os.path.join(cache_dir, f"x_sorted_{key}.npy")
+    if os.path.exists(cache):
+        logging.info("Loading sorted features from cache %s", cache)
+        return np.load(cache, mmap_mode="r")
+
+    # sorting writes into new arrays, so the source can stay memory-mapped
+    src = np.load(x_path, mmap_mode="r")
+    if transpose:
+        src = src.transpose(0, 2, 1)
+    # write under a private name first so concurrent runs never see a partial file
+    tmp = os.path.join(cache_dir, f".x_sorted_{key}.{os.getpid()}.npy")
+    out = None
+    if sort_by == "cluster":
+        # let the cluster sort write its batches straight into the cache file
+        try:
+            out = np.lib.format.open_memmap(
+                tmp, mode="w+", dtype=src.dtype, shape=src.shape
+            )
+        except OSError as e:
+            logging.warning("Could not create cache file %s: %s", tmp, e)
+    try:
+        if sort_by == "cluster":
+            x = cluster_sort(src, out)
+        else:
+            x = _sort_desc(SORT_KEYS[sort_by](src), src)
+        try:
+            if out is None:
+                np.save(tmp, x)
+            else:
+                out.flush()
+            os.replace(tmp, cache)
+            logging.info("Cached sorted features to %s", cache)
+        except OSError as e:
+            logging.warning("Could not cache sorted features to %s: %s", cache, e)
+    finally:
+        # drop a (possibly full-size) temp file left behind by a failed sort or save
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return x
+
+
+def make_dataset(x, y, batch_size, shuffle=False):
+    """
+    Batches of (x, y) gathered on the host from the numpy arrays, so the
+    data is never copied into a tensor. Only the event indices are shuffled
+    (and reshuffled every epoch); batches are prefetched while the model
+    trains.
+    """
+    ds = tf.data.Dataset.range(len(x))
+    if shuffle:
+        ds = ds.shuffle(len(x), reshuffle_each_iteration=True)
+
+    def gather(idx):
+        xb, yb = tf.numpy_function(
+            lambda i: (x[i], y[i]),
+            [idx],
+            (tf.as_dtype(x.dtype), tf.as_dtype(y.dtype)),
+        )
+        xb.set_shape((None,) + x.shape[1:])
+        yb.set_shape((None,) + y.shape[1:])
+        return xb, yb
+
+    return (
+        ds.batch(batch_size)
+        .map(gather, num_parallel_calls=tf.data.AUTOTUNE)
+        .prefetch(tf.data.AUTOTUNE)
+    )
+
+
+def set_mixed_precision_policy():
+    """
+    Use bfloat16 compute on Ampere or newer GPUs and float16 on Volta/Turing;
+    stay in float32 on older GPUs or when no GPU is present.
+    """
+    gpus = tf.config.list_physical_devices("GPU")
+    if not gpus:
+        return "float32"
+    details = tf.config.experimental.get_device_details(gpus[0])
+    cc = details.get("compute_capability", (0, 0))
+    if cc >= (8, 0):
+        policy = "mixed_bfloat16"
+    elif cc >= (7, 0):
+        policy = "mixed_float16"
+    else:
+        return "float32"
+    tf.keras.mixed_precision.set_global_policy(policy)
+    return policy
+
+
+def time_inference(model, input_data, n_runs=20):
+    """
+    Average forward-pass time per event in ns, measured on a traced,
+    XLA-compiled concrete function so Python dispatch is not included.
+    """
+    x = tf.constant(input_data, dtype=tf.float32)
+    infer = tf.function(
+        lambda inp: model(inp, training=False), jit_compile=True
+    ).get_concrete_function(tf.TensorSpec(x.shape, tf.float32))
+
+    # warm-up: compile and allocate buffers
+    _ = infer(x).numpy()
+    times = []
+    for _ in range(n_runs):
+        t0 = time.perf_counter()
+        _ = infer(x).numpy()
+        times.append(time.perf_counter() - t0)
+    return np.mean(times) / x.shape[0] * 1e9
+
+
+def one_vs_rest_roc_curves(y, scores):
+    """
+    One-vs-rest ROC curves (fpr, tpr) for every class column of one-hot
+    labels y and scores, computed from a single argsort over all classes.
+    Matches sklearn's roc_curve points, up to dropped collinear ones.
+    """
+    order = np.argsort(-scores, axis=0, kind="stable")
+    s = np.take_along_axis(scores, order, axis=0)
+    tps = np.cumsum(np.take_along_axis(y == 1, order, axis=0), axis=0)
+    fps = np.arange(1, len(scores) + 1)[:, None] - tps
+    curves = []
+    for i in range(scores.shape[1]):
+        # one point per distinct threshold: the last event of each tied run
+        last = np.r_[s[1:, i] != s[:-1, i], True]
+        tp = np.r_[0, tps[last, i]]
+        fp = np.r_[0, fps[last, i]]
+        curves.append((fp / fp[-1], tp / tp[-1]))
+    return curves
+
+
+def get_flops_cached(get_flops, model, input_shape, cache_path, key):
+    """
+    get_flops(model, input_shape), memoized under `key` in the JSON file at
+    cache_path so the graph freeze and profiler pass run only once per model
+    configuration.
+    """
+    cache = {}
+    if os.path.exists(cache_path):
+        with open(cache_path) as f:
+            cache = json.load(f)
+    if key not in cache:
+        cache[key] = get_flops(model, input_shape)
+        tmp = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+        os.replace(tmp, cache_path)
+    return cache[key]